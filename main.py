@@ -8,15 +8,28 @@
 
 
 import os
+import argparse
+import contextlib
+import hashlib
+import mmap
+import platform
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# Parse arguments before any heavy import, so --help and bad flags return instantly.
+parser = argparse.ArgumentParser(description="Answer questions about the files in sample_docs/.")
+parser.add_argument("--quiet", action="store_true", help="skip diagnostic tables, previews and spinners")
+args = parser.parse_args()
+VERBOSE = not args.quiet  # Diagnostic UI is built and rendered only when True
+
 os.environ["LLAMA_LOG_LEVEL"] = "WARN"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import chromadb
-import openai
 from rich.console import Console
 from rich.table import Table
-from llama_cpp import Llama
 from rich.panel import Panel
+from rich.progress import track
 from rich.spinner import Spinner
 from dotenv import load_dotenv
 load_dotenv()
@@ -28,10 +41,26 @@ console = Console()
 # CONFIGURATION KNOBS
 # =====================
 # --- ChromaDB (Retriever) ---
+CHROMA_PATH = ".chroma_database"  # Persistent index directory, reused across runs
 CHROMA_N_RESULTS = 3  # Number of chunks to retrieve per query
 CHUNK_SIZE = 500      # Number of characters per chunk
 CHUNK_OVERLAP = 100   # Overlap between chunks
-# (distance_metric and min_score are not directly exposed in ChromaDB's Python API, but can be added if needed)
+CHUNK_SEPARATORS = ("\n\n", ". ", "\n", " ")  # Preferred chunk break points, best first
+CHROMA_BATCH_SIZE = 200  # Chunks per collection.add() call (Chroma recommends 50-250)
+CHROMA_DISTANCE = "cosine"  # HNSW space; MiniLM embeddings are trained for cosine similarity
+CHROMA_HNSW_M = 16  # Graph neighbors per node (memory vs. recall)
+CHROMA_HNSW_CONSTRUCTION_EF = 100  # Candidate list size while building the index
+CHROMA_HNSW_SEARCH_EF = 64  # Candidate list size per query (latency vs. recall)
+# (min_score is not directly exposed in ChromaDB's Python API, but can be added if needed)
+
+# --- Embeddings ---
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"  # sentence-transformers model used for chunks and queries
+EMBEDDING_BATCH_SIZE = 64  # Chunks per forward pass (encode() groups similar lengths to minimize padding)
+EMBEDDING_CACHE_PATH = ".embedding_cache.db"  # sqlite file caching chunk embeddings across runs
+EMBEDDING_CACHE_DTYPE = "float32"  # On-disk precision of cached vectors; "float16" halves the file, but re-ingests from cache then store fp16-rounded vectors
+EMBEDDING_DEVICE = None  # "cuda", "mps" or "cpu"; None picks the fastest available
+QUERY_CACHE_SIZE = 1024  # Question embeddings memoized per session
+EMBEDDING_QUANTIZE = True  # On CPU, use the model's int8 ONNX export (needs optimum[onnxruntime])
 
 # --- LLM (Generator) ---
 LLM_MAX_TOKENS = 256
@@ -39,55 +68,352 @@ LLM_TEMPERATURE = 0.2
 LLM_TOP_P = 1.0  # Only used by OpenAI, not llama.cpp
 LLM_STOP = ["\n"]  # Stop sequence for Llama and OpenAI
 LLM_SYSTEM_PROMPT = "You are a helpful assistant. Answer only using the provided context. If the answer is not present, say you don't know."
+LLM_PROMPT_TEMPLATE = "Context:\n{context}\n\nQuestion: {question}\nAnswer:"  # User prompt for Llama and OpenAI
 LLM_MODEL = "gpt-4-turbo-preview"  # OpenAI model name
+ANSWER_CACHE_PATH = ".answer_cache.db"  # sqlite file caching LLM answers across runs
+ANSWER_CACHE_SIMILARITY = 0.95  # Reuse a cached answer when a past question is at least this similar (cosine)
+LLAMA_N_CTX = 2048  # Context window for local Llama models
+LLAMA_RAM_CACHE_BYTES = 1 << 30  # Prompt (KV state) cache size per loaded Llama model
+LLAMA_N_THREADS = None  # Threads for token generation; None = llama.cpp default (~physical cores, decode is memory-bound)
+LLAMA_N_THREADS_BATCH = os.cpu_count()  # Threads for prompt processing (prefill)
+LLAMA_N_BATCH = 512  # Prompt tokens evaluated per batch
+LLAMA_USE_MLOCK = False  # Opt-in: lock model weights in RAM (needs a high enough RLIMIT_MEMLOCK, see README)
+LLAMA_N_GPU_LAYERS = -1  # Layers to offload when llama.cpp has GPU support (CUDA/Metal); -1 = all
+LLAMA_FLASH_ATTN = True
 
 def get_files():
     """Return list of .txt and .md files in sample_docs directory."""
-    return [
-        f for f in os.listdir(sample_docs_dir)
-        if f.endswith(".txt") or f.endswith(".md")
-    ]
+    # scandir's DirEntry caches the file type, so no extra stat() per file.
+    with os.scandir(sample_docs_dir) as entries:
+        return [
+            e.name for e in entries
+            if e.is_file() and e.name.endswith((".txt", ".md"))
+        ]
 
 def read_text_file(filepath):
     """Read a text file as UTF-8, return content or None on error."""
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""  # mmap can't map an empty file
+            # Decode straight from the page cache instead of copying into a bytes object first.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, "utf-8")
+        # Binary reads skip text mode's universal newlines; translate CRLF/CR here
+        # so chunking sees "\n\n" paragraph breaks in Windows-edited files too.
+        return text.replace("\r\n", "\n").replace("\r", "\n")
     except Exception as e:
         print(f"Error reading {filepath}: {e}")
         return None
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Split text into overlapping chunks."""
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, separators=CHUNK_SEPARATORS):
+    """
+    Split text into overlapping chunks of at most chunk_size characters,
+    ending each chunk at the best paragraph/sentence/word break available
+    in its second half instead of mid-word.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    n = len(text)
+    if n <= chunk_size:
+        return [text] if text else []  # Fits in one chunk; no offsets to compute
+    # Never snap back into the first half of a window (or into the overlap),
+    # so every step advances by at least half a chunk.
+    min_length = max(overlap + 1, chunk_size // 2)
     chunks = []
     start = 0
-    while start < len(text):
+    while start + chunk_size < n:
         end = start + chunk_size
+        for sep in separators:
+            # C-level search bounded by chunk_size; no Python per-character work.
+            boundary = text.rfind(sep, start + min_length, end)
+            if boundary != -1:
+                end = boundary + len(sep)
+                break
         chunks.append(text[start:end])
-        start += chunk_size - overlap
+        start = end - overlap
+    chunks.append(text[start:])
     return chunks
 
-def store_embeddings(chunks, embeddings):
-    collection.add(
-        documents=chunks,
-        embeddings=embeddings.tolist(),
-        ids=[f"chunk_{i}" for i in range(len(chunks))]
+def chunk_id(chunk):
+    """Deterministic ChromaDB ID for a chunk, derived from its content."""
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+
+def open_collection(name="simple_chunks"):
+    """
+    Get the chunk collection, recreating it if it was built with a different
+    embedder or HNSW settings. Vectors come back from the embedding cache,
+    so a rebuild is cheap.
+    """
+    metadata = {
+        "embedder": embedder_id,
+        "hnsw:space": CHROMA_DISTANCE,
+        "hnsw:M": CHROMA_HNSW_M,
+        "hnsw:construction_ef": CHROMA_HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF,
+    }
+    collection = client.get_or_create_collection(name, metadata=metadata)
+    current = collection.metadata or {}
+    if any(current.get(k) != v for k, v in metadata.items()):
+        client.delete_collection(name)
+        collection = client.get_or_create_collection(name, metadata=metadata)
+    return collection
+
+def embed_and_store(chunks):
+    """
+    Sync the collection with the given chunks: embed and add chunks whose ID
+    is not stored yet and delete stored chunks that no longer exist in the docs.
+    New chunks are embedded and added one batch at a time, so at most two
+    batches of vectors are held in memory. Returns (added, removed, stored) counts.
+    """
+    ids = [chunk_id(c) for c in chunks]
+    existing = set(collection.get(include=[])["ids"])
+    new = {}  # id -> index of first occurrence (identical chunks share an ID)
+    for i, cid in enumerate(ids):
+        if cid not in existing and cid not in new:
+            new[cid] = i
+    stale = existing.difference(ids)
+    if stale:
+        collection.delete(ids=list(stale))
+    new_ids = list(new)
+    new_indices = list(new.values())
+    batch_starts = range(0, len(new_ids), CHROMA_BATCH_SIZE)
+    show_progress = VERBOSE and bool(new_ids)
+    # Embed batch N+1 on this thread while a writer thread inserts batch N;
+    # both the model forward pass and Chroma's index writes release the GIL.
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = None
+        for start in track(batch_starts, description="Embedding new chunks...", disable=not show_progress):
+            batch = [chunks[i] for i in new_indices[start:start + CHROMA_BATCH_SIZE]]
+            vectors = embed_chunks(batch)
+            if pending is not None:
+                pending.result()  # Re-raise insert errors; keep one insert in flight
+            pending = writer.submit(
+                collection.add,
+                documents=batch,
+                embeddings=vectors,  # float32 ndarray; Chroma accepts it directly
+                ids=new_ids[start:start + CHROMA_BATCH_SIZE],
+            )
+        if pending is not None:
+            pending.result()
+    return len(new), len(stale), len(existing) - len(stale) + len(new)
+
+def get_embedding_device():
+    """Return the device to run the embedder on, preferring CUDA, then Apple MPS, then CPU."""
+    if EMBEDDING_DEVICE:
+        return EMBEDDING_DEVICE
+    import torch
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def get_onnx_int8_file():
+    """Pick the prebuilt int8 ONNX export of the embedding model that matches this CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+def load_embedder():
+    """
+    Load the sentence-transformers model. Returns (model, model_id), where
+    model_id names the exact weights in use so caches never mix vectors
+    from different variants.
+    """
+    # torch/sentence-transformers take seconds to import; defer them until
+    # Step 3 so the file and chunk summaries appear right away.
+    from sentence_transformers import SentenceTransformer
+    device = get_embedding_device()
+    if EMBEDDING_QUANTIZE and device == "cpu":
+        onnx_file = get_onnx_int8_file()
+        try:
+            model = SentenceTransformer(
+                EMBEDDING_MODEL_NAME,
+                device=device,
+                backend="onnx",
+                model_kwargs={"file_name": onnx_file},
+            )
+            return model, f"{EMBEDDING_MODEL_NAME}:{onnx_file}"
+        except Exception as e:
+            # sentence-transformers re-raises a missing optimum/onnx as a bare
+            # Exception, so name the underlying error to keep a broken setup visible.
+            reason = f"{type(e).__name__}: {e}"
+            if e.__context__ is not None:
+                reason += f" (from {type(e.__context__).__name__}: {e.__context__})"
+            console.print(f"[bold yellow]Quantized ONNX embedder failed to load, falling back to the slower PyTorch model. {reason}[/bold yellow]")
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, device=device), EMBEDDING_MODEL_NAME
+
+_QUERY_EMBEDDING_CACHE = {}  # normalized question -> unit-length vector, oldest first
+
+def normalize_query(query):
+    """
+    Canonical form of a question for embedding and caching: collapsed
+    whitespace, and lowercase when the embedder's tokenizer lowercases anyway
+    (e.g. MiniLM). Neither changes the embedding, but it lets case/spacing
+    variants share a cache entry; cased models keep the question's case.
+    """
+    query = " ".join(query.split())
+    return query.lower() if getattr(embedder.tokenizer, "do_lower_case", False) else query
+
+def embed_queries(queries):
+    """
+    Return unit-length embeddings for a list of questions. Repeated questions
+    are served from a per-session cache; the rest are encoded in one batch.
+    """
+    queries = [normalize_query(q) for q in queries]
+    # Collect this batch's vectors locally: eviction below may drop entries
+    # (even ones from this batch) when the batch or cache is full.
+    found = {q: _QUERY_EMBEDDING_CACHE[q] for q in queries if q in _QUERY_EMBEDDING_CACHE}
+    missing = [q for q in dict.fromkeys(queries) if q not in found]
+    if missing:
+        vectors = embedder.encode(
+            missing, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+        found.update(zip(missing, vectors))
+        _QUERY_EMBEDDING_CACHE.update(zip(missing, vectors))
+        while len(_QUERY_EMBEDDING_CACHE) > QUERY_CACHE_SIZE:
+            del _QUERY_EMBEDDING_CACHE[next(iter(_QUERY_EMBEDDING_CACHE))]
+    return np.stack([found[q] for q in queries])
+
+def retrieve(queries, n_results=CHROMA_N_RESULTS, with_distances=VERBOSE):
+    """
+    Embed a batch of questions in one forward pass and search the collection
+    with all of them in a single query call.
+    Returns (query_embeddings, documents, distances); documents and distances
+    hold one list per question, in input order. distances is None unless
+    with_distances is set (only the verbose sources table reads them).
+    """
+    queries = list(queries)
+    query_embeddings = embed_queries(queries)
+    if stored_chunks == 0:
+        # Nothing indexed: skip the Chroma round-trip for a guaranteed-empty result.
+        distances = [[] for _ in queries] if with_distances else None
+        return query_embeddings, [[] for _ in queries], distances
+    # Ask only for what callers use; the default include also loads metadatas.
+    results = collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        include=["documents", "distances"] if with_distances else ["documents"],
     )
+    return query_embeddings, results["documents"], results["distances"]
+
+def open_embedding_cache(path=EMBEDDING_CACHE_PATH):
+    """Open the sqlite embedding cache, creating its table if needed."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB)")
+    return conn
+
+def embedding_cache_key(chunk):
+    """Cache key for a chunk: embeddings are a pure function of (model, text)."""
+    return hashlib.sha256(f"{embedder_id}|{EMBEDDING_CACHE_DTYPE}|{chunk}".encode("utf-8")).digest()
 
 def embed_chunks(chunks):
     """
-    Given a list of text chunks, return a list of embedding vectors.
+    Given a list of text chunks, return a list of unit-length embedding vectors.
+    Vectors already in the embedding cache are reused; only new chunks are encoded.
+    """
+    keys = [embedding_cache_key(c) for c in chunks]
+    cached = {}
+    for i in range(0, len(keys), 500):  # Stay under sqlite's bound-variable limit
+        batch = keys[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        cached.update(embedding_cache.execute(
+            f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", batch
+        ))
+
+    embeddings = np.empty((len(chunks), embedder.get_sentence_embedding_dimension()), dtype=np.float32)
+    hits, missing = [], []
+    for i, key in enumerate(keys):
+        (hits if key in cached else missing).append(i)
+    if hits:
+        # One join + frombuffer + fancy-index assignment instead of a per-row copy loop.
+        embeddings[hits] = np.frombuffer(
+            b"".join([cached[keys[i]] for i in hits]), dtype=EMBEDDING_CACHE_DTYPE
+        ).reshape(len(hits), -1)
+    if missing:
+        # encode() sorts its input by length before batching ("smart batching"),
+        # so a larger batch size mostly cuts per-call overhead without adding padding.
+        new_vectors = embedder.encode(
+            [chunks[i] for i in missing],
+            batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+        embeddings[missing] = new_vectors
+        embedding_cache.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+            [(keys[i], vec.astype(EMBEDDING_CACHE_DTYPE).tobytes()) for i, vec in zip(missing, new_vectors)],
+        )
+        embedding_cache.commit()
+    # Normalize once here so cosine distance in Chroma reduces to a dot product.
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+def open_answer_cache(path=ANSWER_CACHE_PATH):
+    """Open the sqlite answer cache, creating its table if needed."""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers (model TEXT, context_key BLOB, query_vec BLOB, answer TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (model, context_key)")
+    return conn
+
+def context_cache_key(context_chunks):
+    """
+    Key for everything besides the question that shapes an answer: the retrieved
+    chunks, the embedder behind the question vectors, and the prompt and
+    generation settings. Changing any of them starts a fresh cache scope.
+    """
+    settings = repr((
+        embedder_id, LLM_SYSTEM_PROMPT, LLM_PROMPT_TEMPLATE,
+        LLM_MAX_TOKENS, LLM_TEMPERATURE, LLM_TOP_P, LLM_STOP,
+    ))
+    return hashlib.sha256("\x00".join([settings, *context_chunks]).encode("utf-8")).digest()
+
+def lookup_cached_answer(model, context_chunks, query_vector):
+    """
+    Return a cached answer from `model` for a question whose unit-normalized
+    embedding is within ANSWER_CACHE_SIMILARITY of `query_vector`, or None.
     """
-    return embedder.encode(chunks, show_progress_bar=True)
+    rows = answer_cache.execute(
+        "SELECT query_vec, answer FROM answers WHERE model = ? AND context_key = ?",
+        (model, context_cache_key(context_chunks)),
+    ).fetchall()
+    if not rows:
+        return None
+    # Stored vectors are unit length, so cosine similarity is a single mat-vec product.
+    vectors = np.frombuffer(b"".join(vec for vec, _ in rows), dtype=np.float32).reshape(len(rows), -1)
+    similarities = vectors @ query_vector
+    best = int(np.argmax(similarities))
+    return rows[best][1] if similarities[best] >= ANSWER_CACHE_SIMILARITY else None
+
+def store_cached_answer(model, context_chunks, query_vector, answer):
+    """Remember `answer` for later questions similar to this one."""
+    answer_cache.execute(
+        "INSERT INTO answers (model, context_key, query_vec, answer) VALUES (?, ?, ?, ?)",
+        (model, context_cache_key(context_chunks), query_vector.astype(np.float32).tobytes(), answer),
+    )
+    answer_cache.commit()
+
+# One client per process so HTTP keep-alive/TLS sessions are reused across questions.
+_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+_openai_client = None
+
+def get_openai_client():
+    """Create the shared OpenAI client on first use (openai is only imported if needed)."""
+    global _openai_client
+    if _openai_client is None:
+        if not _OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY environment variable not set.")
+        import openai
+        _openai_client = openai.OpenAI(api_key=_OPENAI_API_KEY)
+    return _openai_client
 
 def ask_openai(context_chunks, user_query, model=LLM_MODEL, max_tokens=LLM_MAX_TOKENS, temperature=LLM_TEMPERATURE, top_p=LLM_TOP_P, system_prompt=LLM_SYSTEM_PROMPT, stop=LLM_STOP):
     context = "\n".join(context_chunks)
-    prompt = f"Context:\n{context}\n\nQuestion: {user_query}\nAnswer:"
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable not set.")
-    client = openai.OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
+    prompt = LLM_PROMPT_TEMPLATE.format(context=context, question=user_query)
+    response = get_openai_client().chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
@@ -100,9 +426,44 @@ def ask_openai(context_chunks, user_query, model=LLM_MODEL, max_tokens=LLM_MAX_T
     )
     return response.choices[0].message.content.strip()
 
+_LLM_CACHE = {}  # (model_path, n_ctx) -> loaded Llama instance; holds at most one model
+
+def get_llama(model_path, n_ctx=LLAMA_N_CTX):
+    """
+    Load a Llama model once and reuse it, with a RAM cache for repeated prompt
+    prefixes. Switching models unloads the previous one first, so only one set
+    of weights (and its RAM cache) is ever resident.
+    """
+    key = (model_path, n_ctx)
+    if key not in _LLM_CACHE:
+        for old in _LLM_CACHE.values():
+            old.close()
+        _LLM_CACHE.clear()
+        # Imported here so OpenAI-only runs never load the llama.cpp shared library.
+        from llama_cpp import Llama, LlamaRAMCache, llama_supports_gpu_offload
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=LLAMA_N_THREADS,
+            n_threads_batch=LLAMA_N_THREADS_BATCH,
+            n_batch=LLAMA_N_BATCH,
+            use_mlock=LLAMA_USE_MLOCK,
+            n_gpu_layers=LLAMA_N_GPU_LAYERS if llama_supports_gpu_offload() else 0,
+            flash_attn=LLAMA_FLASH_ATTN,
+        )
+        llm.set_cache(LlamaRAMCache(capacity_bytes=LLAMA_RAM_CACHE_BYTES))
+        _LLM_CACHE[key] = llm
+    return _LLM_CACHE[key]
+
+def thinking_status(model_name):
+    """Spinner shown while the LLM runs; a no-op in --quiet mode (no render thread)."""
+    if not VERBOSE:
+        return contextlib.nullcontext()
+    return console.status(f"[bold green]Thinking... (running {model_name} model)[/bold green]", spinner="dots")
+
 def ask_llama(context_chunks, user_query, llm, max_tokens=LLM_MAX_TOKENS, temperature=LLM_TEMPERATURE, stop=LLM_STOP):
     context = "\n".join(context_chunks)
-    prompt = f"Context:\n{context}\n\nQuestion: {user_query}\nAnswer:"
+    prompt = LLM_PROMPT_TEMPLATE.format(context=context, question=user_query)
     output = llm(prompt, max_tokens=max_tokens, temperature=temperature, stop=stop)
     return output["choices"][0]["text"].strip()
 
@@ -122,120 +483,139 @@ model_display_names = {
 
 # Step 1: Get files
 files = get_files()
-file_table = Table(title="Files Found in sample_docs")
-file_table.add_column("File Name", style="green")
-for fname in files:
-    file_table.add_row(fname)
-console.print(file_table)
+if VERBOSE:
+    file_table = Table(title="Files Found in sample_docs")
+    file_table.add_column("File Name", style="green")
+    for fname in files:
+        file_table.add_row(fname)
+    console.print(file_table)
 
 # Step 2: Read and chunk each file
 all_chunks = []
-chunk_table = Table(title="Chunking Summary")
-chunk_table.add_column("File", style="cyan")
-chunk_table.add_column("Chunks", style="magenta")
-for fname in files:
-    path = os.path.join(sample_docs_dir, fname)
-    content = read_text_file(path)
-    if content:
-        chunks = chunk_text(content)
-        chunk_table.add_row(fname, str(len(chunks)))
-        all_chunks.extend(chunks)
-    else:
-        console.print(f"[red]Skipping {fname} due to read error.[/red]")
-console.print(chunk_table)
+chunk_counts = []
+# Reads release the GIL, so overlap them in a thread pool; chunking stays
+# on the main thread since it is CPU-bound Python. map() yields each file as
+# soon as it (and the files before it) are read, so chunking file N overlaps
+# with reading the files after it.
+paths = [os.path.join(sample_docs_dir, fname) for fname in files]
+with ThreadPoolExecutor(max_workers=min(32, len(paths) or 1)) as executor:
+    for fname, content in zip(files, executor.map(read_text_file, paths)):
+        if content:
+            chunks = chunk_text(content)
+            chunk_counts.append((fname, len(chunks)))
+            all_chunks.extend(chunks)
+        else:
+            console.print(f"[red]Skipping {fname} due to read error.[/red]")
+if VERBOSE:
+    chunk_table = Table(title="Chunking Summary")
+    chunk_table.add_column("File", style="cyan")
+    chunk_table.add_column("Chunks", style="magenta")
+    for fname, count in chunk_counts:
+        chunk_table.add_row(fname, str(count))
+    console.print(chunk_table)
 
-if all_chunks:
+if not all_chunks:
+    console.print("[red]No chunks to embed.[/red]")
+elif VERBOSE:
     console.print(f"[bold green]Total chunks from all files:[/bold green] {len(all_chunks)}")
     console.print(f"[bold]First chunk preview:[/bold] {all_chunks[0]}")
-else:
-    console.print("[red]No chunks to embed.[/red]")
 
-# Step3: Embed these chunks
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-if all_chunks:
-    embeddings = embed_chunks(all_chunks)
-    console.print(f"[bold green]Number of embeddings:[/bold green] {len(embeddings)}")
-    console.print(f"[bold green]Embedding vector length:[/bold green] {len(embeddings[0])}")
-else:
-    console.print("[red]No chunks to embed.[/red]")
-
-# Step4: Store these chunks in a vector database
-client = chromadb.PersistentClient(path=".chroma_database")
-collection = client.get_or_create_collection("simple_chunks")
-
-# ---
-# For now, clear the collection at the start of each run to avoid duplicate chunks.
-# This is a simple way to ensure we don't accumulate duplicate data while developing.
-# In a production system, a better solution is to use unique, deterministic IDs for each chunk
-# and only add new/changed data. We'll add that later for incremental/efficient updates.
-client.delete_collection("simple_chunks")  # Delete the entire collection to remove all documents
-collection = client.get_or_create_collection("simple_chunks")  # Recreate the collection
-# ---
-
-if all_chunks:
-    store_embeddings(all_chunks, embeddings)
-    console.print(f"[bold green]Stored {len(all_chunks)} chunks in ChromaDB.[/bold green]")
-
-# Step 5: Query the vector database for relevant chunks
-user_query = console.input("[bold blue]Ask a question:[/bold blue] ")
-query_embedding = embedder.encode([user_query])
-results = collection.query(
-    query_embeddings=query_embedding.tolist(),
-    n_results=CHROMA_N_RESULTS
-)
-relevant_chunks = results.get("documents", [[]])[0]
-scores = results.get("distances", [[]])[0]
-
-result_table = Table(title="Relevant Chunks from ChromaDB")
-result_table.add_column("Rank", style="cyan", justify="right")
-result_table.add_column("Score (lower=better)", style="magenta")
-result_table.add_column("Chunk Preview", style="white")
-for i, (chunk, score) in enumerate(zip(relevant_chunks, scores), 1):
-    preview = chunk[:100].replace('\n', ' ') + ("..." if len(chunk) > 100 else "")
-    result_table.add_row(str(i), f"{score:.4f}", preview)
-console.print(result_table)
-
-
-print("\nRelevant chunks retrieved from ChromaDB:")
-for i, chunk in enumerate(relevant_chunks, 1):
-    print(f"{i}. {chunk[:200]}")  # Print a preview of each chunk
+# Step3 + Step4: Embed new chunks and store them in a vector database
+embedder, embedder_id = load_embedder()
+embedding_cache = open_embedding_cache()
+client = chromadb.PersistentClient(path=CHROMA_PATH)
+collection = open_collection()
 
+# Chunk IDs are content hashes, so unchanged chunks are neither re-embedded
+# nor re-inserted; only new/removed chunks touch the index.
+added, removed, stored_chunks = embed_and_store(all_chunks)
+if VERBOSE:
+    console.print(f"[bold green]Embedding vector length:[/bold green] {embedder.get_sentence_embedding_dimension()}")
+    if added or removed:
+        console.print(f"[bold green]ChromaDB up to date:[/bold green] {added} chunks added, {removed} removed.")
+    else:
+        console.print("[bold green]ChromaDB already up to date.[/bold green]")
 
-# Step6: Use the LLM to answer the question
-console.print("\n[bold blue]Select which LLM to use to answer your question:[/bold blue]")
-for idx, (_, desc) in enumerate(model_options, 1):
-    default_str = " [default]" if idx == 1 else ""
-    console.print(f"  {idx}. {desc}{default_str}")
-
+# Steps 5-7 repeat until a blank question, so the embedder, ChromaDB client,
+# loaded Llama models and OpenAI client stay warm between questions.
+# Semantic answer cache: paraphrases of an earlier question over the same
+# retrieved chunks reuse that answer instead of calling the LLM again.
+answer_cache = open_answer_cache()
 while True:
-    llm_choice_input = console.input("[bold blue]Enter the number of the model to use [1]: [/bold blue]").strip()
-    if llm_choice_input == "":
-        llm_choice = model_options[0][0]  # Default to first model
+    # Step 5: Query the vector database for relevant chunks
+    try:
+        user_query = console.input("[bold blue]Ask a question (blank to quit):[/bold blue] ").strip()
+    except (EOFError, KeyboardInterrupt):
         break
-    if llm_choice_input.isdigit():
-        idx = int(llm_choice_input)
-        if 1 <= idx <= len(model_options):
-            llm_choice = model_options[idx-1][0]
+    if not user_query:
+        break
+    query_embeddings, documents, distances = retrieve([user_query])
+    relevant_chunks = documents[0]
+
+    if VERBOSE:
+        scores = distances[0]
+        result_table = Table(title="Relevant Chunks from ChromaDB")
+        result_table.add_column("Rank", style="cyan", justify="right")
+        result_table.add_column("Score (lower=better)", style="magenta")
+        result_table.add_column("Chunk Preview", style="white")
+        for i, (chunk, score) in enumerate(zip(relevant_chunks, scores), 1):
+            preview = chunk[:100].replace('\n', ' ') + ("..." if len(chunk) > 100 else "")
+            result_table.add_row(str(i), f"{score:.4f}", preview)
+        console.print(result_table)
+
+        print("\nRelevant chunks retrieved from ChromaDB:")
+        for i, chunk in enumerate(relevant_chunks, 1):
+            print(f"{i}. {chunk[:200]}")  # Print a preview of each chunk
+
+
+    # Step6: Use the LLM to answer the question
+    console.print("\n[bold blue]Select which LLM to use to answer your question:[/bold blue]")
+    for idx, (_, desc) in enumerate(model_options, 1):
+        default_str = " [default]" if idx == 1 else ""
+        console.print(f"  {idx}. {desc}{default_str}")
+
+    while True:
+        llm_choice_input = console.input("[bold blue]Enter the number of the model to use [1]: [/bold blue]").strip()
+        if llm_choice_input == "":
+            llm_choice = model_options[0][0]  # Default to first model
             break
-    console.print(f"[red]Invalid input. Please enter a number between 1 and {len(model_options)}.[/red]")
+        if llm_choice_input.isdigit():
+            idx = int(llm_choice_input)
+            if 1 <= idx <= len(model_options):
+                llm_choice = model_options[idx-1][0]
+                break
+        console.print(f"[red]Invalid input. Please enter a number between 1 and {len(model_options)}.[/red]")
 
-model_name = model_display_names.get(llm_choice, llm_choice)
-if llm_choice == "openai":
-    with console.status(f"[bold green]Thinking... (running {model_name} model)[/bold green]", spinner="dots"):
+    model_name = model_display_names.get(llm_choice, llm_choice)
+    cache_model = LLM_MODEL if llm_choice == "openai" else llm_choice
+    query_vector = query_embeddings[0]  # Already unit length
+    llm_answer = lookup_cached_answer(cache_model, relevant_chunks, query_vector)
+    if llm_answer is not None:
+        if VERBOSE:
+            console.print(f"[bold green]Reusing cached answer from {model_name} for a similar question.[/bold green]")
+    elif llm_choice == "openai":
+        with thinking_status(model_name):
+            try:
+                llm_answer = ask_openai(relevant_chunks, user_query)
+                store_cached_answer(cache_model, relevant_chunks, query_vector, llm_answer)
+            except Exception as e:
+                console.print(f"[red]OpenAI error: {e}[/red]")
+                llm_answer = "Error: Could not get answer from OpenAI."
+    else:
+        llama_model_path = os.path.join(os.path.dirname(__file__), "models", llm_choice)
+        # Report load/generation failures and keep the session alive, as for OpenAI.
         try:
-            llm_answer = ask_openai(relevant_chunks, user_query)
+            llm = get_llama(llama_model_path)
+            with thinking_status(model_name):
+                llm_answer = ask_llama(relevant_chunks, user_query, llm)
+            store_cached_answer(cache_model, relevant_chunks, query_vector, llm_answer)
         except Exception as e:
-            console.print(f"[red]OpenAI error: {e}[/red]")
-            llm_answer = "Error: Could not get answer from OpenAI."
-else:
-    llama_model_path = os.path.join(os.path.dirname(__file__), "models", llm_choice)
-    llm = Llama(model_path=llama_model_path, n_ctx=2048)
-    with console.status(f"[bold green]Thinking... (running {model_name} model)[/bold green]", spinner="dots"):
-        llm_answer = ask_llama(relevant_chunks, user_query, llm)
+            console.print(f"[red]{model_name} error: {e}[/red]")
+            llm_answer = f"Error: Could not get answer from {model_name}."
 
 
-# Step7: Return the answer
-# console.print(f"[bold yellow]LLM Answer:[/bold yellow] {llm_answer}")
-# After getting llm_answer
-console.print(Panel(llm_answer, title="LLM Answer", style="bold yellow"))
-#console.print(f"[bold green]Final answer:[/bold green] {llm_answer}")
\ No newline at end of file
+    # Step7: Return the answer
+    # console.print(f"[bold yellow]LLM Answer:[/bold yellow] {llm_answer}")
+    # After getting llm_answer
+    console.print(Panel(llm_answer, title="LLM Answer", style="bold yellow"))
+    #console.print(f"[bold green]Final answer:[/bold green] {llm_answer}")
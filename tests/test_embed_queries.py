@@ -0,0 +1,72 @@
+"""Regression tests for the per-session question embedding cache in main.py."""
+import ast
+import os
+import unittest
+
+import numpy as np
+
+MAIN_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "main.py")
+
+
+class FakeTokenizer:
+    do_lower_case = True
+
+
+class FakeEmbedder:
+    """Deterministic stand-in for SentenceTransformer.encode()."""
+
+    tokenizer = FakeTokenizer()
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=False):
+        self.encoded.append(list(texts))
+        vectors = np.array([[len(t), sum(map(ord, t)) % 97 + 1] for t in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_query_cache(cache_size):
+    """
+    Compile only the query-cache definitions from main.py (importing it would
+    run the whole ingest/question flow) into a namespace with a fake embedder.
+    """
+    with open(MAIN_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    wanted = {"_QUERY_EMBEDDING_CACHE", "normalize_query", "embed_queries"}
+    nodes = [
+        node for node in tree.body
+        if (isinstance(node, ast.FunctionDef) and node.name in wanted)
+        or (isinstance(node, ast.Assign) and any(getattr(t, "id", None) in wanted for t in node.targets))
+    ]
+    namespace = {"np": np, "embedder": FakeEmbedder(), "QUERY_CACHE_SIZE": cache_size}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), MAIN_PATH, "exec"), namespace)
+    return namespace
+
+
+class EmbedQueriesTest(unittest.TestCase):
+    def setUp(self):
+        self.ns = load_query_cache(cache_size=4)
+        self.embed_queries = self.ns["embed_queries"]
+
+    def expected(self, queries):
+        return FakeEmbedder().encode(queries)
+
+    def test_batch_larger_than_cache(self):
+        queries = [f"q{i}" for i in range(6)]
+        np.testing.assert_allclose(self.embed_queries(queries), self.expected(queries))
+        self.assertEqual(len(self.ns["_QUERY_EMBEDDING_CACHE"]), 4)
+
+    def test_full_cache_hit_on_oldest_plus_new_question(self):
+        self.embed_queries(["a", "b", "c", "d"])
+        np.testing.assert_allclose(self.embed_queries(["a", "e"]), self.expected(["a", "e"]))
+        self.assertEqual(self.ns["embedder"].encoded[-1], ["e"])
+
+    def test_repeated_and_variant_questions_share_one_encode(self):
+        result = self.embed_queries(["Hello  world", "hello world", "Hello world"])
+        self.assertEqual(self.ns["embedder"].encoded, [["hello world"]])
+        self.assertEqual(result.shape, (3, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()